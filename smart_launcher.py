@@ -12,6 +12,11 @@ Requirements:   Needs the chooseRandom.py server script from https://github.com/
                 assignment service to function correctly. Similarly, smart_selector.py from my own project page
                 must be running in order for string-file launching to work. This server script is available at:
                 https://github.com/Raptor2k1/361-Project
+                Several copies of smart_selector.py can be run at once, by passing each of their endpoints on the
+                command line (e.g. "python smart_launcher.py tcp://localhost:5555 tcp://localhost:5565"). Requests
+                are spread across them in turn, moving on to the next one if a copy doesn't answer or is busy.
+                To run more than one launcher, give each its own catalog endpoint with --catalog (e.g.
+                "--catalog tcp://*:5558"), and pass every launcher's endpoint to the servers' --catalog option.
 
 References:     Sockets / ZeroMQ
                 https://zeromq.org/get-started/
@@ -28,14 +33,36 @@ References:     Sockets / ZeroMQ
 import os
 import time
 import json
+import hashlib
+import heapq
+import math
 import string
 import re
 import zmq
 import sys
+import argparse
 import speech_recognition
 from pathlib import PureWindowsPath
 
 
+# Assignment requests tell the server they will be waited on this long, matching how long the launcher waits
+REQUEST_TIMEOUT_MS = 500
+BUSY_REPLY = ".busy"
+STALE_REPLY = ".stale"
+COMPLETION_COUNT = 5
+
+# Launch history - scores halve every two weeks, and the history file is compacted once it grows past this many lines
+history_path = "launchhistory.txt"
+HISTORY_HALF_LIFE = 14 * 24 * 60 * 60
+MAX_HISTORY_LINES = 1000
+MAX_HISTORY_FILES = 500
+MAX_HISTORY_SCORE = 1e6
+
+# String-file association servers to spread requests across, and where to publish the catalog of files for them
+selector_endpoints = ["tcp://localhost:5555"]
+catalog_endpoint = "tcp://*:5557"
+catalog_socket = None
+
 # Initialize Target Directory for Launching Files
 default_path_init = PureWindowsPath("Launch-Files/")
 default_path_current = default_path_init
@@ -46,11 +73,116 @@ if os.name != 'nt':
     clear_cmd = 'clear'
 
 
+class LaunchHistory:
+    """
+    An append-only record of launched files, rolled up into a score for each file that favors files launched both
+    often and recently. Files are recorded by their path (launch folder and file name), so files with the same name
+    in different launch folders keep separate scores. Each line of the history file is a JSON object structured as
+    {"file": "Launch-Files\\name", "score": 1.0, "time": <epoch seconds>}. Each launch appends a line with a score of
+    1, and compacting the history rewrites it as a single line per file, holding that file's rolled-up score.
+    """
+
+    def __init__(self, path):
+        self._path = path
+        self._scores = {}  # Each file's score, as [score, time the score was last updated]
+        self._line_count = 0
+
+        # Replay the history file to rebuild the scores
+        damaged = False
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as history_file:
+                for line in history_file:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        entry = None
+                    if is_history_entry(entry) is False:
+                        damaged = True  # Skip a line that was only partly written, or doesn't hold a usable score
+                        continue
+                    self.add_score(entry["file"], entry["score"], entry["time"])
+                    self._line_count += 1
+
+        # Rewrite a damaged file too, so new lines aren't appended onto the end of a partial one
+        if damaged is True or self._line_count > MAX_HISTORY_LINES:
+            self.compact()
+
+    def add_score(self, file, score, when):
+        """Decays a file's existing score up to the given time, then adds the new score to it."""
+        if file in self._scores:
+            score += self.get_score(file, when)
+        self._scores[file] = [score, when]
+
+    def get_score(self, file, now) -> float:
+        """Returns a file's score as of the given time, or 0 if it has never been launched."""
+        if file not in self._scores:
+            return 0
+        score, when = self._scores[file]
+        return score * 0.5 ** (max(now - when, 0) / HISTORY_HALF_LIFE)
+
+    def get_scores(self, folder, files) -> dict:
+        """
+        Returns a dictionary of the files (by name) in the folder that have been launched before, with values of
+        their current score. Files that are not in the list are left out, however long the history is.
+        """
+        now = time.time()
+        scores = {}
+        for file in files:
+            path = str(folder / file)
+            if path in self._scores:
+                scores[file] = self.get_score(path, now)
+        return scores
+
+    def record(self, file):
+        """Adds a launch of the file to the history, compacting the history file if it has grown too long."""
+        now = time.time()
+        self.add_score(file, 1, now)
+        with open(self._path, "a", encoding="utf-8") as history_file:
+            history_file.write(json.dumps({"file": file, "score": 1, "time": now}) + "\n")
+        self._line_count += 1
+        if self._line_count > MAX_HISTORY_LINES:
+            self.compact()
+
+    def compact(self):
+        """Rewrites the history file as one line per file, keeping only the MAX_HISTORY_FILES highest scores."""
+        now = time.time()
+        kept = heapq.nlargest(MAX_HISTORY_FILES, self._scores, key=lambda file: self.get_score(file, now))
+        self._scores = {file: [self.get_score(file, now), now] for file in kept}
+
+        # Write to a separate file first, so the history isn't lost if this is interrupted
+        with open(self._path + ".tmp", "w", encoding="utf-8") as history_file:
+            for file in self._scores:
+                history_file.write(json.dumps({"file": file, "score": self._scores[file][0], "time": now}) + "\n")
+        os.replace(self._path + ".tmp", self._path)
+        self._line_count = len(self._scores)
+
+
+def is_history_entry(entry) -> bool:
+    """
+    Returns true if a decoded history line holds a file path with a usable score and time. Python's json accepts NaN
+    and infinity (and bools count as numbers), so the score must be a finite number from 0 up to MAX_HISTORY_SCORE,
+    and the time a finite number.
+    """
+    if isinstance(entry, dict) is False or isinstance(entry.get("file"), str) is False:
+        return False
+    for key in ("score", "time"):
+        if isinstance(entry.get(key), bool) or isinstance(entry.get(key), (int, float)) is False:
+            return False
+        try:
+            if math.isfinite(entry[key]) is False:
+                return False
+        except OverflowError:
+            return False  # An integer too large to be a float
+    return 0 <= entry["score"] <= MAX_HISTORY_SCORE
+
+
 class WordFileTool:
     """Represents a collection of words that are associated with specific files and their affiliated functions."""
     def __init__(self):
         self._files = []
         self._request = None
+        self._history = LaunchHistory(history_path)
+        self._catalog_version = None
+        self._next_selector = 0
 
     # INTERFACE LOOPS
     def main_menu(self):
@@ -71,6 +203,7 @@ class WordFileTool:
                        "*Input '2' for VOICE COMMAND: Launches a file with your voice!\n"
                        "*Input '3' for a SURPRISE: Launches a mystery file! Surprise!\n"
                        "*Input '4' for SETTINGS: Change the launch directory or view its contents.\n"
+                       "*Input '5' to FIND A FILE: Type the start of a file's name to see what matches!\n"
                        "*Input 'HELP' to for additional information on all features.\n"
                        "*Input 'QUIT' to CLOSE this application.\n"
                        ">>>")
@@ -84,6 +217,8 @@ class WordFileTool:
             self.surprise()
         elif choice == "4":
             self.settings_menu()
+        elif choice == "5":
+            self.find_launcher()
         elif choice.lower() == "help":
             os.system(clear_cmd)
             help_me(0)
@@ -141,6 +276,44 @@ class WordFileTool:
         input("\nPress 'Enter' to continue.")
         self.main_menu()
 
+    def find_launcher(self):
+        """
+        Shows the most common file name words that start with a partial input, using the association microservice's
+        autocomplete feature. Each new input narrows the search, and selecting one of the listed words launches a file
+        that matches it.
+        """
+
+        os.system(clear_cmd)
+        self.update_file_list()
+        prefix = input("\nType the start of a word from a file's name, then hit 'Enter' to see what matches.\n"
+                       ">>>")
+        while prefix != "":
+            completions = self.request_completions(prefix)
+            if completions is None:
+                break
+            elif len(completions) == 0:
+                print("\nNothing in the launch folder starts with", prefix + ".")
+            else:
+                print("\nMatches for", prefix + "...")
+                for number, completion in enumerate(completions, start=1):
+                    print(f"*Input '#{number}' to launch {completion}")
+
+            # Selections are marked with '#', so digits typed on their own still narrow the search
+            choice = input("\nInput '#' and a number to launch that match, keep typing to narrow the search, "
+                           "or hit 'Enter' to return to the main menu.\n"
+                           ">>>" + prefix)
+            if choice.startswith("#"):
+                if choice[1:].isdigit() and 1 <= int(choice[1:]) <= len(completions):
+                    self.string_to_file_launch(completions[int(choice[1:]) - 1])
+                    input("\nPress 'Enter' to continue.")
+                    break
+                print("There is no match numbered", choice[1:] + ".")
+            elif choice == "":
+                break
+            else:
+                prefix += choice
+        self.main_menu()
+
     def settings_menu(self):
         """
         A command-line menu that his interface options to 1) Change the target launch directory, 2) Reset the launch
@@ -192,57 +365,128 @@ class WordFileTool:
         """
         Uses a string-to-file association service to determine the mots appropriate file to launch based on the
         parameter string. Launches the file if a matches is found, otherwise returns a message that there was no match
-        and displays available launch files, for reference.
+        and displays available launch files, for reference. If the service is too busy to take the request, says so
+        instead, since the string may well have a match.
         """
 
         # Call microservice to request association
         chosen_file = self.request_association(arg_string)
 
-        if chosen_file is None:
+        if chosen_file == BUSY_REPLY:
+            print("The assignment server is too busy to take requests right now. Please try again in a moment.")
+        elif chosen_file is None:
             print("No files that match that string were detected.")
             self.list_files()
         else:
             print("\nLaunching", chosen_file, "in 1 second...")
             time.sleep(1)
             os.startfile(default_path_current / chosen_file)
+            self._history.record(str(default_path_current / chosen_file))
         return
 
     def request_association(self, user_input: str):
         """
         Requests the association of a string with a file using an association microservice.
-        Sends an array containing the one string to associate and the current list of locally-available files.
+        Sends an array containing the one string to associate, the version of the current catalog of files, and the
+        launch history scores of the catalog's files, which the service uses to favor frequently and recently launched
+        files.
         Receives a dictionary of the string and image path to associate with it and decodes it.
-        Returns the file name to associate with the parameter string.
+        Returns the file name to associate with the parameter string, or BUSY_REPLY if every server that answered
+        turned the request away.
+        """
+
+        weights = self._history.get_scores(default_path_current, self._files)
+        reply = self.ask_selectors({"strings": [user_input], "weights": weights})
+        if reply is None:
+            print("No server response detected. No file launched.")
+            return  # default_file_current
+        elif reply == BUSY_REPLY:
+            return BUSY_REPLY
+        elif reply[user_input] == ".defaultChoice":
+            return None
+        else:
+            print("File selected:", reply[user_input])
+            return reply[user_input]
+
+    def request_completions(self, prefix: str):
+        """
+        Requests the most common file name words that start with the prefix from an association microservice.
+        Returns the list of words, or None if no server was able to answer.
+        """
+
+        reply = self.ask_selectors({"complete": prefix, "k": COMPLETION_COUNT})
+        if reply is None or reply == BUSY_REPLY:
+            print("No server response detected. Completions are unavailable right now.")
+            return None
+        return reply[prefix]
+
+    def ask_selectors(self, request_json: dict):
+        """
+        Sends a request, tagged with the current catalog version, to the association servers. Returns the decoded
+        reply dictionary, BUSY_REPLY if every server that answered turned the request away, or None if none answered.
+        """
+
+        # Take turns between the servers, failing over to the next one if a server doesn't answer or is busy
+        busy = False
+        first_choice = self._next_selector
+        self._next_selector = (self._next_selector + 1) % len(selector_endpoints)
+        for attempt in range(len(selector_endpoints)):
+            endpoint = selector_endpoints[(first_choice + attempt) % len(selector_endpoints)]
+            reply = self.query_selector(endpoint, dict(request_json, catalog=self._catalog_version))
+
+            # Server hasn't received the current catalog yet, so send it the file list along with the request
+            if reply is not None and STALE_REPLY in reply:
+                print("Server catalog is out of date. Resending with file list...")
+                reply = self.query_selector(endpoint, dict(request_json, catalog=self._catalog_version,
+                                                           files=self._files))
+
+            if reply is None or STALE_REPLY in reply:
+                continue
+            elif BUSY_REPLY in reply:
+                print("Server at", endpoint, "is busy...")
+                busy = True
+                continue
+            else:
+                return reply
+
+        if busy is True:
+            return BUSY_REPLY
+        return None
+
+    def query_selector(self, endpoint: str, request_json: dict):
+        """
+        Sends a request to the association server at the endpoint. Returns the decoded reply dictionary, or None if
+        the server did not respond in time or rejected the request's format.
         """
 
         # Connect the socket to the server - timeout set to half a second, since locally processed
         context = zmq.Context()
-        print("Attempting connection to ASSIGNMENT SERVER...")
+        print("Attempting connection to ASSIGNMENT SERVER at", endpoint + "...")
         socket = context.socket(zmq.REQ)
-        socket.setsockopt(zmq.SNDTIMEO, 500)
-        socket.setsockopt(zmq.RCVTIMEO, 500)
+        socket.setsockopt(zmq.SNDTIMEO, REQUEST_TIMEOUT_MS)
+        socket.setsockopt(zmq.RCVTIMEO, REQUEST_TIMEOUT_MS)
         socket.setsockopt(zmq.LINGER, 0)
-        socket.connect("tcp://localhost:5555")
+        socket.connect(endpoint)
 
-        # Compile and send request
-        request_json = {"strings": [user_input], "files": self._files}
+        # Send request - the timeout lets the server skip the work once we've stopped waiting. It is sent as a length
+        # of time rather than a clock time, so the server's clock doesn't need to agree with ours
+        request_json["timeout_ms"] = REQUEST_TIMEOUT_MS
         print("Sending request...")
         socket.send_json(request_json)
 
         # Process Reply
-        if socket.poll(500) == 0:
-            print("No server response detected. No file launched.")
+        if socket.poll(REQUEST_TIMEOUT_MS) == 0:
+            print("No response from", endpoint + ".")
             socket.close()
-            return  # default_file_current
-        else:
-            reply = json.loads(socket.recv().decode())
-            print(reply, "received...")
-            if reply[user_input] == ".defaultChoice":
-                reply[user_input] = None
-            else:
-                print("File selected:", reply[user_input])
-            socket.close()
-            return reply[user_input]
+            return None
+        reply = socket.recv().decode()
+        socket.close()
+        if reply == "format_error":
+            print("Server at", endpoint, "could not read the request.")
+            return None
+        reply = json.loads(reply)
+        print(reply, "received...")
+        return reply
 
     def update_file_list(self):
         """Updates the list of available files in the current launch directory, for reference by the program."""
@@ -253,6 +497,14 @@ class WordFileTool:
         for file in files:
             self._files.append(file)
 
+        # Publish the catalog when it changes, so the association servers can prepare it before it's requested
+        version = catalog_version(self._files)
+        if version != self._catalog_version:
+            self._catalog_version = version
+            catalog_json = {"version": version, "files": self._files}
+            if catalog_socket is not None:
+                catalog_socket.send_multipart([b"catalog", json.dumps(catalog_json).encode()])
+
     def list_files(self):
         """Generates and returns a list of all file names currently available and updates working file list."""
         print("\nFiles available for word-file association...\n"
@@ -269,6 +521,11 @@ def remove_special_chars(substring: str) -> str:
     return word
 
 
+def catalog_version(file_list) -> str:
+    """Returns an identifier for a list of files, matching the one the association server computes for it."""
+    return hashlib.sha1("\n".join(file_list).encode()).hexdigest()
+
+
 def check_request_pipeline(pipe_path):
     """
     Opens/closes inbound pipeline file and checks for an assignment request.
@@ -412,7 +669,8 @@ def help_me(chapter: int):
             "Go for it! Want to launch a game based on a question or a phrase? That works too! As long as \n" \
             "some part of your text input has text that corresponds with the name of a file in the target \n" \
             "launch folder, it will be started up automatically! In the even that multiple files match your \n" \
-            "input, one of them will be randomly selected. In the event that your text doesn't have a match, \n" \
+            "input, one of them will be randomly selected, with files you have launched often or recently being \n" \
+            "more likely to come up. In the event that your text doesn't have a match, \n" \
             "the program will let you know and return a list of the available files to launch to help you tailor \n" \
             "a more relevant input for the next attempt.\n" \
             "\nVOICE COMMAND: This feature is pretty nifty. So long as your operating system’s default microphone \n" \
@@ -428,6 +686,10 @@ def help_me(chapter: int):
             "to have a random-selection microservice automatically choose one for you! As long is there is at \n" \
             "least one file available in the current launch folder, this should work every time \n" \
             "(though it wouldn't be terribly random with only one file).\n" \
+            "\nFIND A FILE: Not sure what a file is called? Type in the first few letters of any word in its name, \n" \
+            "and the most common matching words from the launch folder's file names will be listed. Type '#' and \n" \
+            "a listed number (like '#2') to launch a file that matches it, or keep typing more letters (or digits) \n" \
+            "to narrow the list down. Hit 'Enter' without typing anything to return to the main menu.\n" \
             "\nSETTINGS: If you want to drill down a little deeper into the program and view the current launch \n" \
             "folder and its available files, you can check them out right here! If you would rather choose a \n" \
             "different launch folder, rather than placing things that you want to launch within the default \n" \
@@ -488,8 +750,35 @@ def voice_string():
         return ""
 
 
-# START PROGRAM: Generate a blank dictionary file if necessary
-default_check()
-load_saved_defaults()
-word_files = WordFileTool()
-word_files.main_menu()
+def parse_args():
+    """Reads the association servers to send requests to and the endpoint to publish the catalog of files on."""
+    parser = argparse.ArgumentParser(description="Smart Launcher command-line file launcher.")
+    parser.add_argument("selectors", nargs="*", default=selector_endpoints, metavar="ENDPOINT",
+                        help="Endpoints of the smart_selector.py servers to spread requests across.")
+    parser.add_argument("--catalog", default=catalog_endpoint,
+                        help="Endpoint to publish the catalog of launch files on. Give each running launcher its own, "
+                             "and pass them all to the servers' --catalog option.")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    selector_endpoints = args.selectors
+    catalog_endpoint = args.catalog
+
+    # START PROGRAM: Generate a blank dictionary file if necessary
+    default_check()
+    load_saved_defaults()
+
+    # Open the channel that association servers subscribe to for catalog updates. If another launcher already has
+    # it, carry on without publishing - the servers are then sent the files when they report their catalog is stale
+    catalog_socket = zmq.Context.instance().socket(zmq.PUB)
+    catalog_socket.setsockopt(zmq.LINGER, 0)
+    try:
+        catalog_socket.bind(catalog_endpoint)
+    except zmq.ZMQError as error:
+        print(f"Could not publish the catalog on {catalog_endpoint} ({error}). Pass --catalog to use another port.")
+        catalog_socket.close()
+        catalog_socket = None
+    word_files = WordFileTool()
+    word_files.main_menu()
@@ -11,23 +11,75 @@ Description:    This service is designed to work as part of a microservice archi
                  This allows the recipient to directly index into a file that is determined to correspond with a
                  particular string in the requesting service's own program.
 
+                Several copies of the service can be run side by side (each with its own --port). Every copy
+                subscribes to the client's published catalog of files, so each one has the catalog preprocessed
+                before any request for it arrives, and requests may reference the catalog by version instead of
+                resending the file list.
+
+                Autocomplete requests in the form {"complete": "prefix", "catalog": "..."} are answered with the
+                top-k words from the catalog's file names that start with the prefix, structured as:
+                 {"prefix": ["word_1", "word_2" ...]}
+
 References:     https://zeromq.org/get-started/
                 https://pynative.com/python-regex-split/
                 https://www.scaler.com/topics/remove-special-characters-from-string-python/
 """
 
 import zmq
+import os
 import json
 import string
 import re
 import random
+import time
+import math
+import hashlib
+import argparse
+import sys
+import heapq
+import bisect
+import itertools
+from array import array
+from collections import deque, OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+
+# Admission control - requests arriving while this many are already waiting get an immediate "busy" reply instead
+MAX_QUEUED_REQUESTS = 32
+BUSY_RETRY_MS = 100
+BUSY_REPLY = ".busy"
+STALE_REPLY = ".stale"
+
+# Requests may ask for at most this long (in milliseconds) to be spent on them
+MAX_TIMEOUT_MS = 60 * 60 * 1000
+
+# Weighted selection - larger weights are capped, so a handful of them can never add up to an infinite total
+MAX_WEIGHT = 1e6
+
+# Warm catalogs - this many of the most recently used catalogs are kept preprocessed, one per client launch folder
+MAX_WARM_CATALOGS = 4
+
+# Autocomplete - each trie node caches this many of the best completions beneath it
+MAX_COMPLETIONS = 10
+DEFAULT_COMPLETIONS = 5
+CHILD_SLOTS = sys.maxunicode + 1
+
+# Common irrelevant/short words that never associate a file with a string
+SKIP_WORDS = ("the", "and", "but", "for", "are")
+SPECIAL_CHARS_TABLE = str.maketrans('', '', string.punctuation)
+
+# Catalog preprocessing - file lists at least this long are split into chunks and spread across a process pool
+PARALLEL_THRESHOLD = 50000
+CHUNKS_PER_WORKER = 4
 
 
 class AssignmentRequest:
     """
     An object passed along as an information request. Contains data members for a list of strings, a list of
-    file names, a list of words, a dictionary of string:file associations, and a dictionary of files with values of
-    arrays that contain sub-words found within them (without digits or special characters).
+    file names, a list of words, a dictionary of string:file associations, the preprocessed catalog of its files,
+    the time (on this service's time.monotonic() clock) after which the requesting client will have stopped waiting
+    for a reply, and a
+    dictionary of files with values of the client's launch history score for them.
     """
 
     def __init__(self):
@@ -35,7 +87,9 @@ class AssignmentRequest:
         self._files = []
         self._words = []
         self._string_files_dict = {}
-        self._files_subwords = {}
+        self._deadline = None
+        self._catalog = None
+        self._weights = {}
 
     def get_strings(self):
         return self._strings
@@ -49,8 +103,11 @@ class AssignmentRequest:
     def get_string_files_dict(self):
         return self._string_files_dict
 
-    def get_file_subword_dict(self):
-        return self._files_subwords
+    def get_catalog(self):
+        return self._catalog
+
+    def get_deadline(self):
+        return self._deadline
 
     def set_strings(self, string_list):
         self._strings = string_list
@@ -61,6 +118,21 @@ class AssignmentRequest:
     def set_words(self, word_list):
         self._words = word_list
 
+    def set_deadline(self, deadline):
+        self._deadline = deadline
+
+    def set_weights(self, weight_dict):
+        self._weights = weight_dict
+
+    def use_catalog(self, catalog):
+        """Points the request at an already-preprocessed catalog, rather than scanning its own list of files."""
+        self._catalog = catalog
+        self._files = catalog.get_files()
+
+    def is_expired(self) -> bool:
+        """Returns true if the request carries a deadline and it has already passed."""
+        return self._deadline is not None and time.monotonic() > self._deadline
+
     def init_associations(self):
         """Sets up the initial association dictionary with each requested string matched to an empty array."""
 
@@ -82,36 +154,17 @@ class AssignmentRequest:
                 return file
 
     def keywords_from_files(self):
-        """Scans the local file directory and returns the list of words found within file names within it."""
-
-        # Get files from library and create dictionary entry, keyed to file paths
-        files = self._files
-        for file in files:  # Note: Don't send list as string, or this will look at characters instead
-            self._files_subwords[file] = []
+        """Preprocesses the words found within the request's file names, unless a warm catalog already has them."""
 
-        # Parse file names and add word substrings to a word list
-        word_list = []
-        for key in self._files_subwords.keys():
-            file_string = key
-
-            # Assumes normal 3 letter convention if period is detected at that index and slices extension off
-            if len(key) > 3 and key[-4] == ".":
-                file_string = key[:-4]
-
-            # Split apart all the word-ish substrings in the filename
-            split_words = re.split('[_\-,.]+', file_string)
-
-            # Check for new words from split and add to sub-word list in respective object dictionary
-            for word in split_words:
-                if word not in word_list:
-                    if len(word) > 2:
-                        self._files_subwords[key].append(word)
+        # Note: Don't send list as string, or this will look at characters instead
+        if self._catalog is None:
+            self._catalog = FileCatalog(self._files)
 
     def make_selection(self):
         """
-        Randomly selects one of matching files in the array assigned to each string. The assignment dictionary is
-        updated to match only this single string, instead of an array of possible strings. If the array is empty,
-        a default value is assigned instead.
+        Randomly selects one of matching files in the array assigned to each string, favoring files with higher
+        weights. The assignment dictionary is updated to match only this single string, instead of an array of possible
+        strings. If the array is empty, a default value is assigned instead.
         """
 
         for req_string in self._string_files_dict:
@@ -119,38 +172,368 @@ class AssignmentRequest:
             if choices_available < 1:
                 self._string_files_dict[req_string] = ".defaultChoice"
             else:
-                random_choice = self._string_files_dict[req_string][random.randint(0, choices_available - 1)]
+                # Every match keeps a base weight of 1, so files without any history can still be picked
+                choices = self._string_files_dict[req_string]
+                choice_weights = [1 + min(self._weights.get(file, 0), MAX_WEIGHT) for file in choices]
+                random_choice = random.choices(choices, choice_weights)[0]
                 self._string_files_dict[req_string] = random_choice
 
 
-def process_and_send(request_obj):
+class FileCatalog:
+    """
+    A preprocessed copy of a client's list of files, kept warm between requests. Contains data members for the
+    catalog's version identifier, its list of file names, the same list with repeats removed (which word index
+    positions refer to), the partitions its words were split into, and the best completions for an empty prefix.
+    """
+
+    def __init__(self, file_list, workers=None):
+        self._files = file_list
+        self._version = catalog_version(file_list)
+        self._indexed_files = list(dict.fromkeys(file_list))
+        self._partitions = preprocess_files(self._indexed_files, workers)
+        root_tops = [partition.root_top() for partition in self._partitions]
+        self._root_top = heapq.nsmallest(MAX_COMPLETIONS, itertools.chain(*root_tops))
+
+    def get_files(self):
+        return self._files
+
+    def get_version(self):
+        return self._version
+
+    def complete(self, prefix, k) -> list:
+        """
+        Returns up to k of the most common file name words that start with the prefix (ignoring case). Words that
+        searches skip, or that contain special characters, are left out, so every word returned matches a file.
+        """
+        key = prefix.lower()
+        if key == "":
+            return [word for count, word in self._root_top[:k]]
+        return self._partitions[partition_of(key, len(self._partitions))].complete(key, k)
+
+    def files_matching(self, request_string) -> list:
+        """
+        Returns the files (in catalog order) with a name containing a word that appears within the request string.
+        Words that are short, all digits, or in SKIP_WORDS are ignored.
+        """
+        lowered = request_string.lower()
+        positions = set()
+        for partition in self._partitions:
+            positions.update(partition.positions_matching(lowered))
+        return [self._indexed_files[position] for position in sorted(positions)]
+
+
+class CatalogPartition:
+    """
+    The share of a catalog's words that begin with the characters assigned to one partition (see partition_of). Holds
+    a compressed prefix tree of the lower-cased words, for autocomplete, and an index of the cleaned words to the
+    positions of the files they appear in, for reverse searches. Both are stored flat (see build_partition), so a
+    partition can be built in a separate process and handed back without rebuilding a tree of objects.
+    """
+
+    def __init__(self, encoded):
+        labels, child_keys, child_nodes, top, words, counts, index_words, index_offsets, index_positions = encoded
+        self._labels = labels.split("\0")
+        self._children = dict(zip(child_keys, child_nodes))
+        self._top = top
+        self._words = words.split("\0") if len(counts) > 0 else []
+        self._counts = counts
+        self._index_words = index_words.split("\0") if len(index_offsets) > 1 else []
+        self._index_offsets = index_offsets
+        self._index_positions = index_positions
+
+    def complete(self, key, k) -> list:
+        """Returns up to k of the most common words that start with the lower-cased key."""
+        node = 0
+        while len(key) > 0:
+            child = self._children.get(node * CHILD_SLOTS + ord(key[0]))
+            if child is None:
+                return []
+            label = self._labels[child]
+            if key.startswith(label):
+                key = key[len(label):]
+            elif label.startswith(key):
+                key = ""
+            else:
+                return []
+            node = child
+        return [self._words[word_id] for word_id in self.best_word_ids(node)[:k]]
+
+    def root_top(self) -> list:
+        """Returns the best completions for an empty prefix as (-count, word) pairs, so partitions can be merged."""
+        return [(-self._counts[word_id], self._words[word_id]) for word_id in self.best_word_ids(0)]
+
+    def best_word_ids(self, node) -> list:
+        """Returns the ids of the best words at or beneath a node, most common first."""
+        best = self._top[node * MAX_COMPLETIONS:(node + 1) * MAX_COMPLETIONS]
+        return [word_id for word_id in best if word_id >= 0]
+
+    def positions_matching(self, lowered_string) -> list:
+        """Returns the positions of files with a cleaned word that appears within the lower-cased string."""
+        positions = []
+        for number, word in enumerate(self._index_words):
+            if word in lowered_string:
+                positions.extend(self._index_positions[self._index_offsets[number]:self._index_offsets[number + 1]])
+        return positions
+
+
+def catalog_version(file_list) -> str:
+    """Returns an identifier for a list of files, so a client and the service can agree on a catalog by name."""
+    return hashlib.sha1("\n".join(file_list).encode()).hexdigest()
+
+
+def subwords_for_file(file) -> list:
+    """Returns the word-ish substrings (longer than 2 characters) found within a file name."""
+    file_string = file
+
+    # Assumes normal 3 letter convention if period is detected at that index and slices extension off
+    if len(file) > 3 and file[-4] == ".":
+        file_string = file[:-4]
+
+    # Split apart all the word-ish substrings in the filename
+    split_words = re.split('[_\-,.]+', file_string)
+    return [word for word in split_words if len(word) > 2]
+
+
+def partition_of(key, partition_count) -> int:
+    """Returns which partition a lower-cased word belongs to, going by its first character."""
+    return ord(key[0]) % partition_count
+
+
+def index_chunk(file_list, first_position, partition_count):
+    """
+    Splits each file name in a chunk of the catalog into words. Returns one piece per partition, each a tuple of
+    (searchable words joined by NUL characters, their first spellings joined the same way, an array of how many files
+    each word appears in, cleaned words joined by NUL characters, an array of how many files each cleaned word
+    appears in, and an array of those files' positions). Positions count from first_position, so they refer to the
+    whole catalog.
+    """
+    word_counts = [{} for partition in range(partition_count)]
+    word_files = [{} for partition in range(partition_count)]
+    cleaned_keys = {}  # Each spelling's cleaned, lower-cased form, or None if reverse searches ignore it
+    for position, file in enumerate(file_list, start=first_position):
+        file_words = {}
+        for word in subwords_for_file(file):
+            file_words.setdefault(word.lower(), word)
+
+        for key in file_words:
+            # Only words that are meaningful once special characters are removed can be searched for
+            spelling = file_words[key]
+            if spelling not in cleaned_keys:
+                cleaned_word = remove_special_chars(spelling)
+                cleaned_keys[spelling] = cleaned_word.lower()
+                if cleaned_word.lower() in SKIP_WORDS or len(cleaned_word) < 3 or cleaned_word.isdigit() is True:
+                    cleaned_keys[spelling] = None
+            cleaned_key = cleaned_keys[spelling]
+            if cleaned_key is None:
+                continue
+            positions = word_files[partition_of(cleaned_key, partition_count)].setdefault(cleaned_key, [])
+            if len(positions) == 0 or positions[-1] != position:
+                positions.append(position)
+
+            # Autocomplete only offers words that a search for them will find, so they must not need any cleaning
+            if cleaned_key != key:
+                continue
+            counts = word_counts[partition_of(key, partition_count)]
+            if key in counts:
+                counts[key][1] += 1
+            else:
+                counts[key] = [spelling, 1]
+
+    pieces = []
+    for partition in range(partition_count):
+        counts = word_counts[partition]
+        files = word_files[partition]
+        pieces.append(("\0".join(counts), "\0".join(entry[0] for entry in counts.values()),
+                       array("l", (entry[1] for entry in counts.values())),
+                       "\0".join(files), array("l", (len(positions) for positions in files.values())),
+                       array("l", itertools.chain.from_iterable(files.values()))))
+    return pieces
+
+
+def build_partition(pieces):
+    """
+    Merges one partition's pieces from every chunk (in catalog order), then builds the partition's prefix tree and
+    word index in the flat form CatalogPartition is created from. In the tree, node 0 is the root, labels holds each
+    node's edge label, child_keys/child_nodes pair parent * CHILD_SLOTS + ord(first character of a child's label) with
+    the child, and top holds MAX_COMPLETIONS word ids per node (padded with -1), most common first.
+    """
+    word_counts = {}
+    word_files = {}
+    for count_keys, spellings, counts, file_keys, file_counts, positions in pieces:
+        if len(counts) > 0:
+            for key, spelling, count in zip(count_keys.split("\0"), spellings.split("\0"), counts):
+                if key in word_counts:
+                    word_counts[key][1] += count
+                else:
+                    word_counts[key] = [spelling, count]
+        if len(file_counts) > 0:
+            start = 0
+            for key, file_count in zip(file_keys.split("\0"), file_counts):
+                word_files.setdefault(key, []).extend(positions[start:start + file_count])
+                start += file_count
+
+    keys = sorted(word_counts)
+    words = [word_counts[key][0] for key in keys]
+    counts = array("l", (word_counts[key][1] for key in keys))
+    labels, child_keys, child_nodes, top = build_trie(keys, words, counts)
+
+    index_offsets = array("l", [0])
+    for key in word_files:
+        index_offsets.append(index_offsets[-1] + len(word_files[key]))
+    return ("\0".join(labels), child_keys, child_nodes, top, "\0".join(words), counts,
+            "\0".join(word_files), index_offsets, array("l", itertools.chain.from_iterable(word_files.values())))
+
+
+def build_trie(keys, words, counts):
+    """
+    Builds a compressed prefix tree over sorted, lower-cased keys, caching the best completions at every node. Returns
+    the flat (labels, child_keys, child_nodes, top) form described in build_partition.
+    """
+    # Rank every word once, so each node only has to sort a handful of ranks: most common first, then alphabetical
+    rank = [0] * len(keys)
+    ranked_ids = sorted(range(len(keys)), key=lambda word_id: (-counts[word_id], words[word_id]))
+    for position, word_id in enumerate(ranked_ids):
+        rank[word_id] = position
+
+    labels = [""]
+    child_keys = array("q")
+    child_nodes = array("l")
+    top = array("l", [-1] * MAX_COMPLETIONS)
+
+    def fill(node, low, high, depth):
+        """Adds children for keys[low:high] (which share their first depth characters) and returns the node's best."""
+        best = []
+        if low < high and len(keys[low]) == depth:
+            best.append(low)
+            low += 1
+        while low < high:
+            # Keys are sorted, so the group that continues with the same character is contiguous
+            first = keys[low][depth]
+            end = high
+            if ord(first) < sys.maxunicode:
+                end = bisect.bisect_left(keys, keys[low][:depth] + chr(ord(first) + 1), low, high)
+            common = len(os.path.commonprefix([keys[low], keys[end - 1]]))
+
+            child = len(labels)
+            labels.append(keys[low][depth:common])
+            child_keys.append(node * CHILD_SLOTS + ord(first))
+            child_nodes.append(child)
+            top.extend([-1] * MAX_COMPLETIONS)
+            best.extend(fill(child, low, end, common))
+            low = end
+
+        best.sort(key=rank.__getitem__)
+        del best[MAX_COMPLETIONS:]
+        top[node * MAX_COMPLETIONS:node * MAX_COMPLETIONS + len(best)] = array("l", best)
+        return best
+
+    fill(0, 0, len(keys), 0)
+    return labels, child_keys, child_nodes, top
+
+
+def preprocess_files(file_list, workers=None):
+    """
+    Splits a list of files (without repeats) into the catalog partitions that FileCatalog is built from. Lists of at
+    least PARALLEL_THRESHOLD files (or any list, if a number of workers is given) are split into chunks whose words
+    are found on a pool of processes, and the pool then merges each partition's words from every chunk and builds its
+    part of the prefix tree and word index. Smaller lists become a single partition, built in this process.
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+        if len(file_list) < PARALLEL_THRESHOLD:
+            workers = 1
+    if workers == 1 or len(file_list) == 0:
+        return [CatalogPartition(build_partition(index_chunk(file_list, 0, 1)))]
+
+    partition_count = workers * CHUNKS_PER_WORKER
+    chunk_size = -(-len(file_list) // partition_count)
+    starts = range(0, len(file_list), chunk_size)
+    chunks = [file_list[start:start + chunk_size] for start in starts]
+    pool = process_pool(workers)
+    chunk_pieces = list(pool.map(index_chunk, chunks, starts, itertools.repeat(partition_count)))
+    return [CatalogPartition(encoded) for encoded in pool.map(build_partition, zip(*chunk_pieces))]
+
+
+process_pools = {}
+
+
+def process_pool(workers) -> ProcessPoolExecutor:
+    """Returns a process pool with the given number of workers, starting it the first time it is needed."""
+    if workers not in process_pools:
+        process_pools[workers] = ProcessPoolExecutor(max_workers=workers)
+    return process_pools[workers]
+
+
+def benchmark_preprocessing(file_count):
+    """
+    Times building a catalog (end to end, including the prefix tree and word index) from a generated list of file
+    names serially, then on process pools of 2, 4, 8... workers and of the number of cores, and prints each time
+    alongside its speedup over the serial run.
+    """
+    words = ("holiday", "beach", "mario", "kart", "pizza", "party", "carrot", "veggies", "music", "album", "track")
+    file_list = [f"{words[n % 11]}_{words[n // 11 % 11]}-{words[n // 121 % 11]}_{n}.png" for n in range(file_count)]
+
+    start = time.perf_counter()
+    FileCatalog(file_list, 1)
+    serial_time = time.perf_counter() - start
+    print(f"Preprocessing {file_count} files...")
+    print(f"serial:     {serial_time:.2f}s")
+
+    # Doubling pool sizes, plus the core count itself when it isn't a power of 2
+    core_count = os.cpu_count() or 1
+    if core_count == 1:
+        print("Only one core is available, so there are no parallel runs to compare.")
+    worker_counts = {core_count} if core_count > 1 else set()
+    workers = 2
+    while workers < core_count:
+        worker_counts.add(workers)
+        workers *= 2
+
+    for workers in sorted(worker_counts):
+        process_pool(workers).map(subwords_for_file, [""] * workers)  # Start the pool's processes before timing
+        start = time.perf_counter()
+        FileCatalog(file_list, workers)
+        parallel_time = time.perf_counter() - start
+        print(f"{workers} workers: {parallel_time:.2f}s ({serial_time / parallel_time:.2f}x)")
+
+
+def process_and_send(request_obj, envelope):
     """
     Scans the request pipeline for an object containing a list of strings, a list of file names,
     and list of words. If no list of words is provided, uses the currently-saved internal list.
     If either the file or string list is empty, returns an error explaining why the request is invalid.
-    In either case, clears the request pipeline file after the operation is done.
+    In either case, clears the request pipeline file after the operation is done. Between each stage, newly arrived
+    requests are admitted (or turned away), and this request is dropped without a reply once its client has given up
+    on it. Returns true if a reply was sent.
     """
 
     # Generate list of words available within file path names
     request_obj.keywords_from_files()
+    if between_stages(request_obj, "forward search"):
+        return False
 
     # Filter out common irrelevant/short words and associated words/strings
-    skip_list = ("the", "and", "but", "for", "are")
+    skip_list = SKIP_WORDS
 
     # Abort if incorrect object
     if str(type(request_obj)) != "<class '__main__.AssignmentRequest'>":
-        return
+        return False
 
     # See if any words within the string are contained with a file name and assign them if they are.
     else:
         # Check if a substring in file name or if a file substring in request substring, then update association
         string_list = request_obj.get_strings()
         check_forward(request_obj, string_list, skip_list)
+        if between_stages(request_obj, "reverse search"):
+            return False
         check_reverse(request_obj, skip_list)
+        if between_stages(request_obj, "selection"):
+            return False
 
         # If multiple matches, randomly selects one, then send the updated request object to the outgoing pipeline
         request_obj.make_selection()
-        send_info(request_obj)
+        send_info(request_obj, envelope)
+        return True
 
 
 def check_forward(request_obj, string_list, skip_list):
@@ -174,23 +557,47 @@ def check_forward(request_obj, string_list, skip_list):
 def check_reverse(request_obj, skip_list):
     """
     Checks if any filename substrings are contained within the request object's main string.
-    Updates the string-file association if it is.
+    Updates the string-file association if it is. The catalog's word index has already left out the substrings
+    in the skip list (SKIP_WORDS), along with short and all-digit ones.
     """
     print("\nREVERSE SEARCH START")
     for each_string in request_obj.get_strings():
-        for key in request_obj.get_file_subword_dict():
-            for word_in_path in request_obj.get_file_subword_dict()[key]:
-                cleaned_file_word = remove_special_chars(word_in_path)
-                if cleaned_file_word.lower() in skip_list or len(cleaned_file_word) < 3 \
-                        or cleaned_file_word.isdigit() is True:
-                    continue  # Skip this substring if it's a known irrelevant factor
-
-                if cleaned_file_word.lower() in each_string.lower():
-                    request_obj.update_string_files_dict(each_string, key)
+        for file in request_obj.get_catalog().files_matching(each_string):
+            request_obj.update_string_files_dict(each_string, file)
         print("REVERSE MATCH", "for", each_string + ":", request_obj.get_string_files_dict()[each_string])
 
 
-def send_info(request_obj):
+def deadline_passed(request_obj, stage: str) -> bool:
+    """Returns true (and notes which stage it was caught at) if the request's client has stopped waiting for it."""
+    if request_obj.is_expired():
+        print("Deadline passed before", stage, "- dropping request.")
+        return True
+    return False
+
+
+def between_stages(request_obj, next_stage: str) -> bool:
+    """
+    Admits any requests that arrived during the last stage of processing, then returns true if the request being
+    processed should be dropped before its next stage because its client has stopped waiting for it.
+    """
+    admit_waiting()
+    return deadline_passed(request_obj, next_stage)
+
+
+def admit_waiting():
+    """Admits (or turns away) requests that have already arrived, without waiting for any more."""
+    received = 0
+    while received < MAX_QUEUED_REQUESTS and socket.poll(0) != 0:
+        admit_request(socket.recv_multipart())
+        received += 1
+
+
+def send_reply(envelope, payload: bytes):
+    """Sends a reply payload back to the client identified by the request's routing envelope."""
+    socket.send_multipart(envelope + [payload])
+
+
+def send_info(request_obj, envelope):
     """
     Updates the return pipeline file with a key and path that matches the input string received.
     Takes an array of request objects as a parameter, each having data members for a string, a key,
@@ -198,65 +605,320 @@ def send_info(request_obj):
     """
     # open and write self.request's object or its dictionary attribute
     send_data = request_obj.get_string_files_dict()
-    socket.send_json(send_data)
+    send_reply(envelope, json.dumps(send_data).encode())
+
+
+def send_busy(envelope):
+    """
+    Turns a request away without processing it. The reply is a JSON object structured as
+    {".busy": {"queued": <requests waiting>, "retry_after_ms": <suggested wait>}}, so clients can tell it apart
+    from an assignment dictionary.
+    """
+    busy_data = {BUSY_REPLY: {"queued": len(pending_requests), "retry_after_ms": BUSY_RETRY_MS}}
+    send_reply(envelope, json.dumps(busy_data).encode())
+
+
+def send_stale(envelope):
+    """
+    Lets a client know that the catalog version its request referenced is not one this service has warm. The reply is
+    structured as {".stale": {"catalog": <most recently used version held, or null>}}, and the client should resend
+    the request with its list of files included.
+    """
+    current_version = next(reversed(warm_catalogs), None)
+    stale_data = {STALE_REPLY: {"catalog": current_version}}
+    send_reply(envelope, json.dumps(stale_data).encode())
+
+
+def answer_completion(envelope, request_dict):
+    """
+    Replies to an autocomplete request, structured as {"complete": "prefix", "k": 5, "catalog": "..."}, with up to k
+    of the most common file name words starting with the prefix: {"prefix": ["word_1", "word_2" ...]}. These are
+    answered as soon as they arrive instead of being queued, since each one is only a walk down the catalog's trie.
+    """
+    if error_check_completion(request_dict) is True:
+        print("Sending error message...")
+        send_reply(envelope, b"format_error")
+        return
+
+    catalog = find_catalog(request_dict)
+    if catalog is None:
+        print("Completion referenced an unknown catalog. Sending stale reply...")
+        send_stale(envelope)
+        return
+
+    prefix = request_dict["complete"]
+    completions = catalog.complete(prefix, min(request_dict.get("k", DEFAULT_COMPLETIONS), MAX_COMPLETIONS))
+    send_reply(envelope, json.dumps({prefix: completions}).encode())
 
 
 # Adapted from explanation of strings module located here:
 # https://www.scaler.com/topics/remove-special-characters-from-string-python/
 def remove_special_chars(substring: str) -> str:
     """Returns an argument string with special characters removed."""
-    word = substring.translate(str.maketrans('', '', string.punctuation))
+    word = substring.translate(SPECIAL_CHARS_TABLE)
     return word
 
 
 def error_check_request(request_dict):
     """Returns true if there is an error in the format of the request object."""
-    if "strings" not in request_dict or "files" not in request_dict or len(request_dict["strings"]) < 1:
+    if "strings" not in request_dict or ("files" not in request_dict and "catalog" not in request_dict) \
+            or len(request_dict["strings"]) < 1:
         print("Error: Request contained improper structure.")
         return True
-    elif isinstance(request_dict["strings"], list) is False or isinstance(request_dict["files"], list) is False:
+    elif isinstance(request_dict["strings"], list) is False or isinstance(request_dict.get("files", []), list) is False:
         print("Error: Request keys did not have arrays as values.")
         return True
-    elif request_dict["strings"] is None or request_dict["files"] is None:
+    elif request_dict["strings"] is None or request_dict.get("files", []) is None:
         print("Error: Keys cannot have 'none' types as values. Values must be an array")
         return True
+    elif "catalog" in request_dict and isinstance(request_dict["catalog"], str) is False:
+        print("Error: Request catalog must be a version string.")
+        return True
+    elif "timeout_ms" in request_dict and (is_finite_number(request_dict["timeout_ms"]) is False
+                                           or not 0 <= request_dict["timeout_ms"] <= MAX_TIMEOUT_MS):
+        print(f"Error: Request timeout must be a number of milliseconds from 0 to {MAX_TIMEOUT_MS}.")
+        return True
+    elif "weights" in request_dict and (isinstance(request_dict["weights"], dict) is False or not all(
+            is_finite_number(weight) and weight >= 0 for weight in request_dict["weights"].values())):
+        print("Error: Request weights must map file names to finite, non-negative numbers.")
+        return True
     else:
         print("Request validated.")
         return False
 
 
-def create_request_obj():
+def is_finite_number(value) -> bool:
+    """Returns true if a decoded JSON value is a number other than NaN or infinity (which Python's json accepts)."""
+    if isinstance(value, bool):
+        return False
+    return isinstance(value, int) or (isinstance(value, float) and math.isfinite(value))
+
+
+def error_check_completion(request_dict):
+    """Returns true if there is an error in the format of an autocomplete request."""
+    if isinstance(request_dict["complete"], str) is False or isinstance(request_dict.get("catalog"), str) is False:
+        print("Error: Completion requests need a prefix string and a catalog version string.")
+        return True
+    elif isinstance(request_dict.get("k", DEFAULT_COMPLETIONS), int) is False or request_dict.get("k", 1) < 1:
+        print("Error: Completion count must be a positive integer.")
+        return True
+    elif isinstance(request_dict.get("files", []), list) is False:
+        print("Error: Request keys did not have arrays as values.")
+        return True
+    else:
+        return False
+
+
+def create_request_obj(request_dict):
     """Creates a new request object and initializes its values."""
     request_obj = AssignmentRequest()
-    request_obj.set_files(request_dict["files"])
+    request_obj.set_files(request_dict.get("files", []))
     request_obj.set_strings(request_dict["strings"])
+    # The client sends how long it will wait, so its deadline is measured on this service's own clock
+    if "timeout_ms" in request_dict:
+        request_obj.set_deadline(time.monotonic() + request_dict["timeout_ms"] / 1000)
+    request_obj.set_weights(request_dict.get("weights", {}))
     request_obj.init_associations()
     return request_obj
 
 
-# Set up Server's socket container/transport and bind socket
-context = zmq.Context()
-socket = context.socket(zmq.REP)
-socket.setsockopt(zmq.SNDTIMEO, 500)
-socket.setsockopt(zmq.LINGER, 0)
-socket.bind("tcp://*:5555")
-
-print("Server started!\n")
-
-while True:
-    # Listen for client request
-    request_str = socket.recv().decode()
+def admit_request(frames):
+    """
+    Validates a newly received request and queues it for processing. Malformed requests are answered right away,
+    requests whose deadline has already passed are dropped, and requests that arrive while the queue is full are
+    sent a busy reply so their client doesn't sit out its whole timeout. Since this also runs between the stages of
+    another request's processing, it never preprocesses a catalog itself - that waits until the request is taken
+    off the queue.
+    """
+    envelope, request_str = frames[:-1], frames[-1].decode()
     request_dict = json.loads(request_str)
     print("Received Request JSON...")
     print(request_dict)
 
+    # Autocomplete requests skip the queue
+    if isinstance(request_dict, dict) and "complete" in request_dict:
+        answer_completion(envelope, request_dict)
+        return
+
     # Error handling
     if error_check_request(request_dict) is True:
         print("Sending error message...")
-        socket.send_string("format_error")
+        send_reply(envelope, b"format_error")
+        return
+
+    request_obj = create_request_obj(request_dict)
+    if deadline_passed(request_obj, "admission"):
+        return
+    if len(pending_requests) >= MAX_QUEUED_REQUESTS:
+        print("Request queue is full. Sending busy reply...")
+        send_busy(envelope)
+        return
+    if can_attach_catalog(request_dict) is False:
+        print("Request referenced an unknown catalog. Sending stale reply...")
+        send_stale(envelope)
+        return
+    pending_requests.append((envelope, request_obj, request_dict))
+
+
+def find_catalog(request_dict):
+    """
+    Returns the warm catalog with the version the request references, otherwise returns None. A request that sends
+    its files along with a version this service hasn't seen yet becomes a new warm catalog.
+    """
+    if "catalog" not in request_dict:
+        return None
+    if request_dict["catalog"] not in warm_catalogs:
+        if "files" in request_dict and catalog_version(request_dict["files"]) == request_dict["catalog"]:
+            update_catalog(request_dict["files"])
+    if request_dict["catalog"] in warm_catalogs:
+        warm_catalogs.move_to_end(request_dict["catalog"])  # Mark it as the most recently used
+        return warm_catalogs[request_dict["catalog"]]
+    return None
+
+
+def can_attach_catalog(request_dict) -> bool:
+    """
+    Returns false if a request references a catalog version that isn't warm, without sending any files to fall back
+    on. Unlike attach_catalog, this never preprocesses anything, so it is cheap enough to check on arrival.
+    """
+    if "catalog" not in request_dict or "files" in request_dict:
+        return True
+    return request_dict["catalog"] in warm_catalogs
+
+
+def attach_catalog(request_obj, request_dict) -> bool:
+    """
+    Points a request at a warm catalog if it references the catalog's version. Returns false if the request
+    references an unknown catalog without sending any files to fall back on.
+    """
+    if "catalog" not in request_dict:
+        return True
+    catalog = find_catalog(request_dict)
+    if catalog is not None:
+        request_obj.use_catalog(catalog)
+        return True
+    return "files" in request_dict
+
+
+def update_catalog(file_list):
+    """
+    Preprocesses a newly published (or newly sent) list of files and keeps it warm for the requests that follow. Up to
+    MAX_WARM_CATALOGS catalogs are kept, so clients with different launch folders don't keep replacing each other's,
+    and the least recently used one is dropped to make room.
+    """
+    catalog = FileCatalog(file_list)
+    warm_catalogs[catalog.get_version()] = catalog
+    while len(warm_catalogs) > MAX_WARM_CATALOGS:
+        warm_catalogs.popitem(last=False)
+    print("Catalog updated to version", catalog.get_version(), "with", len(file_list), "files.")
+
+
+def receive_catalog():
+    """
+    Reads a catalog update published by the client, structured as {"version": "...", "files": [...]}. Updates that are
+    malformed, or whose version doesn't match their list of files, are ignored.
+    """
+    frames = catalog_socket.recv_multipart()
+    try:
+        catalog_dict = json.loads(frames[-1].decode())
+    except ValueError:
+        print("Error: Catalog update was not valid JSON.")
+        return
+    if len(frames) != 2 or error_check_catalog(catalog_dict) is True:
+        return
+    if catalog_dict["version"] in warm_catalogs:
+        warm_catalogs.move_to_end(catalog_dict["version"])
+    else:
+        update_catalog(catalog_dict["files"])
 
+
+def error_check_catalog(catalog_dict):
+    """Returns true if there is an error in the format of a catalog update, or its version doesn't match its files."""
+    if isinstance(catalog_dict, dict) is False or "version" not in catalog_dict or "files" not in catalog_dict:
+        print("Error: Catalog update contained improper structure.")
+        return True
+    elif isinstance(catalog_dict["files"], list) is False \
+            or not all(isinstance(file, str) for file in catalog_dict["files"]):
+        print("Error: Catalog update files must be an array of strings.")
+        return True
+    elif catalog_dict["version"] != catalog_version(catalog_dict["files"]):
+        print("Error: Catalog update version did not match its files.")
+        return True
     else:
-        # Create an object for the request, process/send a reply
-        assignment_request_obj = create_request_obj()
-        process_and_send(assignment_request_obj)
-        print("\nAttempted to send reply JSON:", assignment_request_obj.get_string_files_dict())
+        return False
+
+
+def parse_args():
+    """Reads the port to serve requests on and the endpoints to subscribe to catalog updates from."""
+    parser = argparse.ArgumentParser(description="Smart Selector string-file association service.")
+    parser.add_argument("--port", type=int, default=5555,
+                        help="Port to listen for requests on. Give each copy of the service its own port.")
+    parser.add_argument("--catalog", nargs="+", default=["tcp://localhost:5557"], metavar="ENDPOINT",
+                        help="Endpoints that clients publish their catalogs of files on. Give one for each client.")
+    parser.add_argument("--benchmark", type=int, metavar="FILE_COUNT",
+                        help="Compare serial and parallel catalog preprocessing on this many generated file names, "
+                             "then exit instead of starting the service.")
+    return parser.parse_args()
+
+
+def serve():
+    """Listens for catalog updates and client requests, processing queued requests one at a time."""
+    poller = zmq.Poller()
+    poller.register(socket, zmq.POLLIN)
+    poller.register(catalog_socket, zmq.POLLIN)
+
+    while True:
+        # Listen for client requests and catalog updates, only blocking when there is nothing queued to work on
+        wait_ms = None if len(pending_requests) == 0 else 0
+        received = 0
+        while received < MAX_QUEUED_REQUESTS:
+            events = dict(poller.poll(wait_ms))
+            if len(events) == 0:
+                break
+            if catalog_socket in events:
+                receive_catalog()
+            if socket in events:
+                admit_request(socket.recv_multipart())
+                received += 1
+            wait_ms = 0
+
+        if len(pending_requests) > 0:
+            # Shed requests that waited in the queue past their deadline, otherwise process/send a reply
+            reply_envelope, assignment_request_obj, request_dict = pending_requests.popleft()
+            if deadline_passed(assignment_request_obj, "processing"):
+                continue
+
+            # The warm catalog may have changed while the request was queued, so it is looked up (or built) only now
+            if attach_catalog(assignment_request_obj, request_dict) is False:
+                print("Request referenced an unknown catalog. Sending stale reply...")
+                send_stale(reply_envelope)
+                continue
+            if process_and_send(assignment_request_obj, reply_envelope) is True:
+                print("\nAttempted to send reply JSON:", assignment_request_obj.get_string_files_dict())
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.benchmark is not None:
+        benchmark_preprocessing(args.benchmark)
+        raise SystemExit
+
+    # Set up Server's socket container/transport and bind socket - a ROUTER socket lets requests be queued (and turned
+    # away when there are too many) while one is being processed, and still talks to plain REQ clients
+    context = zmq.Context()
+    socket = context.socket(zmq.ROUTER)
+    socket.setsockopt(zmq.SNDTIMEO, 500)
+    socket.setsockopt(zmq.LINGER, 0)
+    socket.bind(f"tcp://*:{args.port}")
+    pending_requests = deque()
+
+    # Subscribe to the clients' catalog updates, so every running copy of the service stays warm
+    catalog_socket = context.socket(zmq.SUB)
+    catalog_socket.setsockopt(zmq.LINGER, 0)
+    catalog_socket.setsockopt(zmq.SUBSCRIBE, b"catalog")
+    for endpoint in args.catalog:
+        catalog_socket.connect(endpoint)
+    warm_catalogs = OrderedDict()  # Catalogs by version, least recently used first
+
+    print(f"Server started on port {args.port}!\n")
+    serve()
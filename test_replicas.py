@@ -0,0 +1,187 @@
+"""
+Description:    Runs the replicated selector topology on one machine: several smart_selector.py processes on their own
+                ports, subscribed to a catalog published by smart_launcher.py's WordFileTool. Checks that every
+                replica answers from its warm catalog, that a replica which missed the catalog is brought up to date
+                through the ".stale" resend, that another client's catalog doesn't push the first one out, and that
+                the launcher fails over when a replica is killed or busy.
+
+                Run with "python test_replicas.py" (or through pytest). Ports 25557 and 25560-25565 must be free.
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import threading
+import subprocess
+import unittest
+import zmq
+
+import smart_launcher
+
+
+SELECTOR_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "smart_selector.py")
+CATALOG_PORT = 25557
+FIRST_PORT = 25560
+REPLICA_COUNT = 3
+LAUNCH_FILES = ["pizza.png", "Mario_Kart.lnk", "carrot-veggies.png"]
+
+
+def endpoint(port) -> str:
+    return f"tcp://localhost:{port}"
+
+
+def start_selector(port):
+    """Starts a copy of the service on the port, subscribed to the test's catalog channel."""
+    return subprocess.Popen([sys.executable, SELECTOR_SCRIPT, "--port", str(port),
+                             "--catalog", endpoint(CATALOG_PORT)],
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def query(port, request_json, timeout_ms=1000):
+    """Sends a raw request to the service on the port. Returns the decoded reply, or None if there was no reply."""
+    socket = zmq.Context.instance().socket(zmq.REQ)
+    socket.setsockopt(zmq.LINGER, 0)
+    socket.connect(endpoint(port))
+    socket.send_json(request_json)
+    reply = None
+    if socket.poll(timeout_ms) != 0:
+        reply = socket.recv().decode()
+        reply = reply if reply == "format_error" else json.loads(reply)
+    socket.close()
+    return reply
+
+
+def catalog_request(version, user_input):
+    """Returns a request that names the catalog by version only, so only a warm replica can answer it."""
+    return {"strings": [user_input], "catalog": version}
+
+
+def wait_until_serving(port):
+    """Waits for the service on the port to start answering requests."""
+    for attempt in range(50):
+        if query(port, {"strings": []}, timeout_ms=200) is not None:
+            return
+    raise RuntimeError(f"Selector on port {port} never started.")
+
+
+def serve_busy(port, stop_event):
+    """Stands in for an overloaded copy of the service, answering every request with a busy reply."""
+    socket = zmq.Context.instance().socket(zmq.ROUTER)
+    socket.setsockopt(zmq.LINGER, 0)
+    socket.bind(f"tcp://*:{port}")
+    while stop_event.is_set() is False:
+        if socket.poll(50) != 0:
+            frames = socket.recv_multipart()
+            busy_data = {".busy": {"queued": 32, "retry_after_ms": 100}}
+            socket.send_multipart(frames[:-1] + [json.dumps(busy_data).encode()])
+    socket.close()
+
+
+class ReplicaTopologyTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        # Run the launcher against a throwaway launch folder (and history file)
+        cls.old_cwd = os.getcwd()
+        cls.work_dir = tempfile.mkdtemp()
+        os.chdir(cls.work_dir)
+        os.mkdir(str(smart_launcher.default_path_init))
+        for file in LAUNCH_FILES:
+            open(os.path.join(str(smart_launcher.default_path_init), file), "w").close()
+
+        smart_launcher.catalog_socket = zmq.Context.instance().socket(zmq.PUB)
+        smart_launcher.catalog_socket.setsockopt(zmq.LINGER, 0)
+        smart_launcher.catalog_socket.bind(f"tcp://*:{CATALOG_PORT}")
+
+        cls.ports = [FIRST_PORT + number for number in range(REPLICA_COUNT)]
+        cls.selectors = {port: start_selector(port) for port in cls.ports}
+        for port in cls.ports:
+            wait_until_serving(port)
+
+        # Publish the catalog until every replica has it, since subscriptions take a moment to reach the publisher
+        cls.tool = smart_launcher.WordFileTool()
+        for attempt in range(20):
+            cls.tool.update_file_list()
+            time.sleep(0.1)
+            version = cls.tool._catalog_version
+            if all(".stale" not in query(port, catalog_request(version, "pizza")) for port in cls.ports):
+                break
+            cls.tool._catalog_version = None
+
+    @classmethod
+    def tearDownClass(cls):
+        for process in cls.selectors.values():
+            process.kill()
+            process.wait()
+        smart_launcher.catalog_socket.close()
+        os.chdir(cls.old_cwd)
+        shutil.rmtree(cls.work_dir)
+
+    def use_replicas(self, ports):
+        smart_launcher.selector_endpoints = [endpoint(port) for port in ports]
+        self.tool._next_selector = 0
+
+    def test_every_replica_answers_from_warm_catalog(self):
+        for port in self.ports:
+            reply = query(port, catalog_request(self.tool._catalog_version, "play mario kart"))
+            self.assertEqual(reply, {"play mario kart": "Mario_Kart.lnk"})
+
+    def test_keeps_other_clients_catalogs_warm(self):
+        # A second client's catalog, sent along with its request, shouldn't push the first client's catalog out
+        other_files = ["pizza-party.png", "beach_holiday.png"]
+        other_version = smart_launcher.catalog_version(other_files)
+        other_request = dict(catalog_request(other_version, "beach"), files=other_files)
+        self.assertEqual(query(self.ports[0], other_request), {"beach": "beach_holiday.png"})
+        self.assertEqual(query(self.ports[0], catalog_request(other_version, "beach")), {"beach": "beach_holiday.png"})
+        reply = query(self.ports[0], catalog_request(self.tool._catalog_version, "pizza"))
+        self.assertEqual(reply, {"pizza": "pizza.png"})
+
+    def test_requests_rotate_across_replicas(self):
+        self.use_replicas(self.ports)
+        for attempt in range(REPLICA_COUNT * 2):
+            self.assertEqual(self.tool.request_association("pizza time"), "pizza.png")
+        self.assertEqual(self.tool._next_selector, 0)
+
+    def test_stale_replica_is_sent_files(self):
+        # A replica started after the catalog was published has to be sent the files with the request
+        late_port = FIRST_PORT + REPLICA_COUNT
+        self.selectors[late_port] = start_selector(late_port)
+        wait_until_serving(late_port)
+        self.assertIn(".stale", query(late_port, catalog_request(self.tool._catalog_version, "pizza")))
+
+        self.use_replicas([late_port])
+        self.assertEqual(self.tool.request_association("pizza"), "pizza.png")
+        self.assertEqual(query(late_port, catalog_request(self.tool._catalog_version, "pizza")), {"pizza": "pizza.png"})
+
+    def test_fails_over_from_killed_replica(self):
+        dead_port = FIRST_PORT + REPLICA_COUNT + 1
+        dead_selector = start_selector(dead_port)
+        self.selectors[dead_port] = dead_selector
+        wait_until_serving(dead_port)
+        dead_selector.kill()
+        dead_selector.wait()
+
+        self.use_replicas([dead_port, self.ports[0]])
+        for attempt in range(2):
+            self.assertEqual(self.tool.request_association("veggies"), "carrot-veggies.png")
+
+    def test_fails_over_from_busy_replica(self):
+        busy_port = FIRST_PORT + REPLICA_COUNT + 2
+        stop_event = threading.Event()
+        busy_thread = threading.Thread(target=serve_busy, args=(busy_port, stop_event))
+        busy_thread.start()
+        try:
+            self.use_replicas([busy_port, self.ports[0]])
+            self.assertEqual(self.tool.request_association("veggies"), "carrot-veggies.png")
+            self.use_replicas([busy_port])
+            self.assertEqual(self.tool.request_association("veggies"), smart_launcher.BUSY_REPLY)
+        finally:
+            stop_event.set()
+            busy_thread.join()
+
+
+if __name__ == "__main__":
+    unittest.main()